@@ -5,10 +5,17 @@ Defines layout and visual components for the Superstore dashboard.
 Includes dropdown filters, date pickers, and interactive charts using Plotly.
 """
 
-from data import data
 from dash import html, dcc, dash_table
+from urllib.parse import urlencode
 import dash_bootstrap_components as dbc
 import plotly.express as px
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+from plotly.subplots import make_subplots
+from data import lttb
+
+# Max points per time-series trace, roughly the pixel width of a full-width card
+timeline_points = 800
 
 
 # Graphics
@@ -113,6 +120,113 @@ def us_state_map(
     return fig
 
 
+def us_city_map(
+    df,
+    lat,
+    lon,
+    size,
+    hover_name=None,
+    hover_data=None,
+    title=None,
+    color="rgb(51, 102, 255)",
+):
+    """
+    Scatter map of the USA with one weighted marker per (aggregated) location
+    https://plotly.com/python/scatter-plots-on-maps/
+    :param df: DataFrame with one row per marker
+    :param lat: Column with latitudes
+    :param lon: Column with longitudes
+    :param size: Column used to scale the markers
+    :param hover_name: Column shown as the hover title
+    :param hover_data: Extra columns shown on hover
+    :param title: Title of the map
+    :param color: Marker color
+    :return: Scatter geo figure
+    """
+    fig = px.scatter_geo(
+        df,
+        lat=lat,
+        lon=lon,
+        size=size,
+        hover_name=hover_name,
+        hover_data=hover_data,
+        scope="usa",
+        title=title,
+        color_discrete_sequence=[color],
+    )
+    return fig
+
+
+def time_series(daily, x_range=None, max_points=timeline_points):
+    """
+    Daily orders and sales with rolling averages, one subplot each.
+    Every trace is downsampled with LTTB to at most max_points points.
+    https://plotly.com/python/subplots/
+    :param daily: DataFrame from Data.daily_orders()
+    :param x_range: Optional (start, end) dates; only that range is plotted
+    :param max_points: Maximum number of points per trace
+    :return: Plotly figure
+    """
+    if x_range is not None:
+        daily = daily.loc[x_range[0] : x_range[1]]
+    fig = make_subplots(
+        rows=2,
+        cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.08,
+        subplot_titles=("Orders per Day", "Sales per Day"),
+    )
+    x = daily.index.asi8
+    dates = daily.index.strftime("%Y-%m-%d")
+    for row, (column, color) in enumerate(
+        [("Orders", "rgb(153, 51, 255)"), ("Sales", "rgb(0, 172, 105)")], start=1
+    ):
+        for suffix, name, width, opacity in [
+            ("", "Daily", 1, 0.35),
+            ("_7d", "7-day avg", 2, 1),
+            ("_30d", "30-day avg", 2, 0.6),
+        ]:
+            y = daily[column + suffix]
+            keep = lttb(x, y.to_numpy(), max_points)
+            fig.add_trace(
+                go.Scatter(
+                    # Plain dates keep the payload small
+                    x=dates[keep],
+                    y=y.iloc[keep],
+                    name=f"{column} {name}",
+                    mode="lines",
+                    line={"color": color, "width": width},
+                    opacity=opacity,
+                ),
+                row=row,
+                col=1,
+            )
+    # uirevision keeps the zoom when the figure is replaced after a zoom
+    fig.update_layout(uirevision="timeline", hovermode="x unified", height=550)
+    if x_range is not None:
+        fig.update_xaxes(range=list(x_range))
+    return fig
+
+
+def timeline_range(relayout):
+    """
+    Reads the x range from a Graph's relayoutData.
+    :param relayout: relayoutData of the time-series graph
+    :return: (start, end) of the zoomed range, None after an autorange (reset),
+             or False if the event did not change the x axis
+    """
+    relayout = relayout or {}
+    for key, value in relayout.items():
+        if key.startswith("xaxis") and key.endswith(".autorange"):
+            return None
+    for key, value in relayout.items():
+        if key.startswith("xaxis") and key.endswith(".range[0]"):
+            return value, relayout[key.replace("[0]", "[1]")]
+        if key.startswith("xaxis") and key.endswith(".range"):
+            return tuple(value)
+    return False
+
+
 # Dash components
 def header():
     """
@@ -188,7 +302,7 @@ def shipping_modes(obj):
                     # https://dash.plotly.com/datatable
                     dash_table.DataTable(
                         obj.ship_modes_info.to_dict("records"),
-                        [{"name": i, "id": i} for i in data.ship_modes_info.columns],
+                        [{"name": i, "id": i} for i in obj.ship_modes_info.columns],
                         style_cell={"textAlign": "left"},
                     ),
                 ],
@@ -268,6 +382,58 @@ def order_by_location(obj):
     )
 
 
+def order_by_city(obj):
+    """
+    :return: Dash html.Div component containing the city-level order map
+    """
+    return html.Div(
+        [
+            html.Div(
+                [
+                    html.H3("Order volume by city", className="section-title"),
+                    dcc.Graph(
+                        figure=us_city_map(
+                            obj.city_markers_info,
+                            "Latitude",
+                            "Longitude",
+                            "Order_Count",
+                            hover_name="Label",
+                            hover_data={
+                                "Order_Count": True,
+                                "Sales": ":,.2f",
+                                "Latitude": False,
+                                "Longitude": False,
+                            },
+                        )
+                    ),
+                ],
+                className="card-content",
+            )
+        ],
+        className="component-section",
+    )
+
+
+def order_timeline(obj):
+    """
+    :return: Dash html.Div component containing daily orders and sales over time
+    """
+    return html.Div(
+        [
+            html.Div(
+                [
+                    html.H3("Orders and Sales over Time", className="section-title"),
+                    dcc.Graph(
+                        id="timeline-graph", figure=time_series(obj.daily_orders())
+                    ),
+                ],
+                className="card-content",
+            )
+        ],
+        className="component-section",
+    )
+
+
 def order_trends(obj):
     """
     :return: Dash html.Div component containing monthly and Weekly order patterns
@@ -316,24 +482,83 @@ def order_trends(obj):
 """
 
 
-def filter_bar():
+def facet_options(values, counts):
+    """
+    Dropdown options labelled with the number of orders each one would match.
+    Options with no matching orders are dimmed, but can still be selected.
+    :param values: Option values, in display order
+    :param counts: Series of order counts indexed by value
+    :return: list of dcc.Dropdown options
+    """
+    options = []
+    for i in values:
+        count = int(counts.get(i, 0))
+        options.append(
+            {
+                "label": html.Span(
+                    f"{i} ({count})",
+                    className="option-empty" if count == 0 else None,
+                ),
+                "value": i,
+                "search": str(i),
+            }
+        )
+    return options
+
+
+def filter_options(obj, counts):
     """
+    :param obj: Unfiltered Data object, which defines the option order
+    :param counts: dict returned by Data.facet_counts()
+    :return: list with the options of the five filter dropdowns, in filter-bar order
+    """
+    return [
+        facet_options(obj.ship_modes_info["Ship_Mode"].unique(), counts["Ship_Mode"]),
+        facet_options(
+            obj.orders_per_segment_info["Segment"].unique(), counts["Segment"]
+        ),
+        facet_options(obj.orders_per_state_info["State"].unique(), counts["State"]),
+        facet_options(
+            obj.orders_per_month_info["Month"].unique(), counts["Order_Month"]
+        ),
+        facet_options(
+            obj.orders_per_week_info["Weekday"].unique(), counts["Order_Weekday"]
+        ),
+    ]
+
+
+def filter_bar(obj, datasets=None, dataset=None):
+    """
+    :param obj: Data object whose unique values populate the dropdowns
+    :param datasets: Names of the datasets served by the app
+    :param dataset: Name of the dataset currently shown
     :return: Dash html.Div component containing filters
 
     Unique  values in each Dropdown
     https://community.plotly.com/t/how-to-populate-a-dropdown-from-unique-values-in-a-pandas-data-frame/5543/2
     """
+    ship_options, segment_options, state_options, month_options, week_options = (
+        filter_options(obj, obj.facet_counts(None, None, None, None, None))
+    )
+    datasets = datasets or []
     return html.Div(
         [
             html.Div(
                 [
+                    dcc.Dropdown(
+                        id="dataset-select",
+                        className="dropdown",
+                        options=[{"label": i, "value": i} for i in datasets],
+                        value=dataset,
+                        clearable=False,
+                        placeholder="Dataset...",
+                        # Only useful when the app serves several datasets
+                        style=None if len(datasets) > 1 else {"display": "none"},
+                    ),
                     dcc.Dropdown(
                         id="filter-ship",
                         className="dropdown",
-                        options=[
-                            {"label": i, "value": i}
-                            for i in data.ship_modes_info["Ship_Mode"].unique()
-                        ],
+                        options=ship_options,
                         multi=True,
                         placeholder="Filter by Ship Mode...",
                         value=None,
@@ -341,10 +566,7 @@ def filter_bar():
                     dcc.Dropdown(
                         id="filter-segment",
                         className="dropdown",
-                        options=[
-                            {"label": i, "value": i}
-                            for i in data.orders_per_segment_info["Segment"].unique()
-                        ],
+                        options=segment_options,
                         multi=True,
                         placeholder="Filter by Customer Segment...",
                         value=None,
@@ -352,10 +574,7 @@ def filter_bar():
                     dcc.Dropdown(
                         id="filter-state",
                         className="dropdown",
-                        options=[
-                            {"label": i, "value": i}
-                            for i in data.orders_per_state_info["State"].unique()
-                        ],
+                        options=state_options,
                         multi=True,
                         placeholder="Filter by State...",
                         value=None,
@@ -363,10 +582,7 @@ def filter_bar():
                     dcc.Dropdown(
                         id="filter-month",
                         className="dropdown",
-                        options=[
-                            {"label": i, "value": i}
-                            for i in data.orders_per_month_info["Month"].unique()
-                        ],
+                        options=month_options,
                         multi=True,
                         placeholder="Filter by Month...",
                         value=None,
@@ -374,29 +590,123 @@ def filter_bar():
                     dcc.Dropdown(
                         id="filter-week",
                         className="dropdown",
-                        options=[
-                            {"label": i, "value": i}
-                            for i in data.orders_per_week_info["Weekday"].unique()
-                        ],
+                        options=week_options,
                         multi=True,
                         placeholder="Filter by Weekday...",
                         value=None,
                     ),
                 ],
                 className="filter-content",
-            )
+            ),
+            # Shown while the charts are being recomputed
+            html.Div(
+                [
+                    html.Progress(id="filter-progress", value=0, max=3),
+                    html.Span("Updating charts..."),
+                ],
+                id="filter-status",
+                className="progress-content",
+                style={"visibility": "hidden"},
+            ),
+            # Download the rows behind the current selection
+            html.Div(
+                [
+                    html.A(
+                        "Download CSV",
+                        id="export-csv",
+                        href=export_href("csv", dataset),
+                        className="export-link",
+                    ),
+                    html.A(
+                        "Download Parquet",
+                        id="export-parquet",
+                        href=export_href("parquet", dataset),
+                        className="export-link",
+                    ),
+                ],
+                className="export-content",
+            ),
         ],
         className="component-section",
     )
 
 
+def export_href(
+    file_format,
+    dataset=None,
+    ship_value=None,
+    segment_value=None,
+    state_value=None,
+    month_value=None,
+    week_value=None,
+):
+    """
+    :param file_format: "csv" or "parquet"
+    :param dataset: Selected dataset
+    :return: URL of the /export route for the given filters
+    """
+    query = {
+        "format": file_format,
+        "dataset": dataset,
+        "ship": ship_value,
+        "segment": segment_value,
+        "state": state_value,
+        "month": month_value,
+        "week": week_value,
+    }
+    query = {k: v for k, v in query.items() if v}
+    return "/export?" + urlencode(query, doseq=True)
+
+
 # Principal Layout
-def serve_layout():
+def loading_layout(status):
+    """
+    Placeholder shown while the dataset is still loading in the background.
+    :param status: dict returned by DataLoader.status()
+    :return: html.Div with the loading progress
+    """
+    if status["state"] == "failed":
+        message = f'Dataset could not be loaded: {status["error"]}'
+    else:
+        message = f'Loading dataset... {status["progress"]:.0%} ({status["stage"] or "starting"})'
+    return html.Div(
+        [header(), html.P(message)],
+        style={"padding": "2rem", "fontSize": "1.2rem"},
+        id="app",
+    )
+
+
+def initial_cards(obj):
+    """
+    Renders every card for the unfiltered dataset. Computed once at startup and
+    embedded in the layout, so the first paint needs no callback round trip.
+    :param obj: Loaded (unfiltered) Data object
+    :return: JSON of a dict mapping card id to its children. Kept serialized, so
+             the memory it holds is known (and counted by the DatasetRegistry).
+    """
+    cards = {
+        "avg_shipping": avg_shipping(obj),
+        "shipping_modes": shipping_modes(obj),
+        "order_by_segment": order_by_segment(obj),
+        "order_by_location": order_by_location(obj),
+        "order_by_city": order_by_city(obj),
+        "order_timeline": order_timeline(obj),
+        "order_trends": order_trends(obj),
+    }
+    return to_json_plotly(cards)
+
+
+def serve_layout(obj, cards=None, datasets=None, dataset=None):
     """
     Builds the main layout of the dashboard.
+    :param obj: Loaded Data object
+    :param cards: Optional prerendered card contents (initial_cards(), deserialized)
+    :param datasets: Names of the datasets served by the app
+    :param dataset: Name of the dataset shown in the layout
     :Returns: html.Div: Complete layout for the Dash app.
     """
-    if data.df is None or data.df.empty:
+    cards = cards or {}
+    if obj is None or obj.df is None or obj.df.empty:
         return html.Div(
             ["No data available to display the dashboard."],
             style={"padding": "2rem", "fontSize": "1.2rem"},
@@ -404,35 +714,88 @@ def serve_layout():
 
     return html.Div(
         [
+            # ?dataset=<name> selects the dataset
+            dcc.Location(id="url", refresh=False),
+            # Filter selection handed to the background job (cache misses only)
+            dcc.Store(id="filter-job"),
+            # Polls a dataset selected while it is still loading
+            dcc.Interval(id="dataset-poll", interval=500, disabled=True),
+            dcc.Store(id="dataset-loaded"),
             header(),
             html.Hr(),
             # Filter bar
             html.Div(
                 [
-                    html.Div([filter_bar()], className="card-full", id="filter-bar"),
+                    html.Div(
+                        [filter_bar(obj, datasets, dataset)],
+                        className="card-full",
+                        id="filter-bar",
+                    ),
                 ],
                 className="row",
             ),
             # Shipping overview and modes
             html.Div(
                 [
-                    html.Div(className="card-half", id="avg_shipping"),
-                    html.Div(className="card-half", id="shipping_modes"),
+                    html.Div(
+                        cards.get("avg_shipping"),
+                        className="card-half",
+                        id="avg_shipping",
+                    ),
+                    html.Div(
+                        cards.get("shipping_modes"),
+                        className="card-half",
+                        id="shipping_modes",
+                    ),
                 ],
                 className="row",
             ),
             # Segment and Location
             html.Div(
                 [
-                    html.Div(className="card-half", id="order_by_segment"),
-                    html.Div(className="card-half", id="order_by_location"),
+                    html.Div(
+                        cards.get("order_by_segment"),
+                        className="card-half",
+                        id="order_by_segment",
+                    ),
+                    html.Div(
+                        cards.get("order_by_location"),
+                        className="card-half",
+                        id="order_by_location",
+                    ),
+                ],
+                className="row",
+            ),
+            # City map
+            html.Div(
+                [
+                    html.Div(
+                        cards.get("order_by_city"),
+                        className="card-full",
+                        id="order_by_city",
+                    ),
+                ],
+                className="row",
+            ),
+            # Daily time series
+            html.Div(
+                [
+                    html.Div(
+                        cards.get("order_timeline"),
+                        className="card-full",
+                        id="order_timeline",
+                    ),
                 ],
                 className="row",
             ),
             # Trends
             html.Div(
                 [
-                    html.Div(className="card-full", id="order_trends"),
+                    html.Div(
+                        cards.get("order_trends"),
+                        className="card-full",
+                        id="order_trends",
+                    ),
                 ],
                 className="row",
             ),
@@ -9,65 +9,499 @@ but you can customize this with the assets_url_path argument to dash.Dash.
 https://dash.plotly.com/external-resources
 """
 
-from data import data_copy, data
-from dash import Dash, callback, Input, Output, html
-from components import (
-    header,
-    avg_shipping,
-    shipping_modes,
-    order_by_segment,
-    order_by_location,
-    order_trends,
+from data import data_copy, csv_file, DatasetRegistry
+from json_api import normalized_filters, register_api
+from result_cache import (
+    ResultCache,
+    default_cache_dir,
+    filter_params,
+    normalize_filters,
 )
+from dash import (
+    Dash,
+    DiskcacheManager,
+    Input,
+    Output,
+    State,
+    ctx,
+    html,
+    no_update,
+    set_props,
+)
+from dash.exceptions import PreventUpdate
+from flask import Response, jsonify, request
+from urllib.parse import parse_qs, urlencode
+import diskcache
+import importlib.util
+import json
+import os
+import tempfile
 import components
 
+# Job store of the background callbacks, shared by the workers on a host
+default_jobs_dir = os.path.join(tempfile.gettempdir(), "superstore_dashboard_jobs")
+
 """
 scatter_map configuration https://docs.sisense.com/main/SisenseLinux/scatter-map.htm
 """
 
-# Initialize the dash application
-app = Dash()
-server = app.server
-# Requires Dash 2.17.0 or later
-app.layout = html.Div([components.serve_layout(), html.Div(id="output-id")])
-
-
-# Callback function
-# Register all interactive callbacks for the dashboard
-@callback(
-    Output("avg_shipping", "children"),
-    Output("shipping_modes", "children"),
-    Output("order_by_segment", "children"),
-    Output("order_by_location", "children"),
-    Output("order_trends", "children"),
-    Input("filter-ship", "value"),  # ID from element, variable
-    Input("filter-segment", "value"),
-    Input("filter-state", "value"),
-    Input("filter-month", "value"),
-    Input("filter-week", "value"),
-)
-# This connects the UI filters with chart updates
-def update_output(ship_value, segment_value, state_value, month_value, week_value):
+
+def create_app(
+    datasets=csv_file,
+    warm_up=True,
+    memory_budget=512 * 2**20,
+    cache_dir=default_cache_dir,
+    cache_size=256 * 2**20,
+    jobs_dir=default_jobs_dir,
+):
     """
-    Updates all dashboard visual components based on user-selected filters.
-    :param ship_value: Selected shipping modes.
-    :param segment_value: elected customer segments.
-    :param state_value: Selected states.
-    :param month_value: Selected months.
-    :param week_value: Selected weekdays.
-    :return: A tuple of Dash components (graphs) reflecting the updated data.
+    Application factory. Builds the Dash app without touching the data;
+    datasets are loaded by a DatasetRegistry in background threads.
+    :param datasets: CSV file, folder of CSV files, or dict of name -> CSV path.
+                     The first dataset is the default one.
+    :param warm_up: Start loading the default dataset immediately.
+    :param memory_budget: Memory (bytes) the loaded datasets may use before the
+                          least recently used ones are evicted.
+    :param cache_dir: Folder of the result cache shared by the workers on this
+                      host, or None to disable it.
+    :param cache_size: Maximum size (bytes) of the result cache.
+    :param jobs_dir: Folder of the background job store, or None to run the
+                     filter callback inside the web worker.
+    :return: Dash application with /ready, /datasets, /export and /api/v1 routes
+             on app.server
     """
-    filtered = data_copy(
-        data, ship_value, segment_value, state_value, month_value, week_value
+    if isinstance(datasets, str) and os.path.isdir(datasets):
+        registry = DatasetRegistry.from_directory(
+            datasets, memory_budget=memory_budget, on_ready=components.initial_cards
+        )
+    else:
+        if isinstance(datasets, str):
+            datasets = {os.path.splitext(os.path.basename(datasets))[0]: datasets}
+        registry = DatasetRegistry(
+            datasets, memory_budget=memory_budget, on_ready=components.initial_cards
+        )
+    # The layout only contains the filters once the data is ready
+    manager = None
+    if jobs_dir:
+        # DiskcacheManager runs each job in its own process (multiprocess, psutil)
+        # https://dash.plotly.com/background-callbacks
+        if all(importlib.util.find_spec(i) for i in ("multiprocess", "psutil")):
+            manager = DiskcacheManager(diskcache.Cache(jobs_dir))
+        else:
+            print("multiprocess/psutil not installed: filter callbacks run inline.")
+    app = Dash(
+        __name__,
+        suppress_callback_exceptions=True,
+        background_callback_manager=manager,
     )
-    return (
-        components.avg_shipping(filtered),
-        components.shipping_modes(filtered),
-        components.order_by_segment(filtered),
-        components.order_by_location(filtered),
-        components.order_trends(filtered),
+    app.registry = registry
+    cache = ResultCache(cache_dir, cache_size) if cache_dir else None
+    app.result_cache = cache
+
+    def report_progress(step, steps=3):
+        """
+        Moves the progress bar of the filter callback. Sent to the browser while
+        a background job runs (set_props); inline it only shows the final state.
+        """
+        set_props("filter-progress", {"value": step, "max": steps})
+
+    def ready_loader(dataset):
+        """
+        Never waits for a dataset that is still loading, so the worker thread is
+        not held for the whole load: the dataset-poll interval re-runs the
+        callbacks once it is loaded.
+        :return: The loaded DataLoader for a dataset, or None while it is loading
+        """
+        try:
+            loader = registry.get(dataset, timeout=0)
+        except KeyError:
+            raise PreventUpdate
+        if loader.state == "loading":
+            set_props("dataset-poll", {"disabled": False})
+            return None
+        if not loader.ready:
+            raise PreventUpdate
+        return loader
+
+    def layout():
+        """
+        Evaluated on every page load, so workers that are still warming up
+        serve a progress placeholder instead of failing.
+        """
+        loader = registry.loader()
+        if not loader.ready:
+            return components.loading_layout(loader.status())
+        return html.Div(
+            [
+                components.serve_layout(
+                    loader.data,
+                    json.loads(loader.extra),
+                    registry.names(),
+                    registry.default,
+                ),
+                html.Div(id="output-id"),
+            ]
+        )
+
+    # Requires Dash 2.17.0 or later
+    app.layout = layout
+
+    @app.server.route("/ready")
+    def ready():
+        """
+        Readiness probe for the load balancer: 200 once the default dataset is
+        loaded, 503 (with the loading progress) until then.
+        """
+        loader = registry.loader()
+        return jsonify(loader.status()), 200 if loader.ready else 503
+
+    @app.server.route("/datasets")
+    def datasets_status():
+        """
+        Load state, load time and memory of every registered dataset, and the
+        result cache usage (hits and misses of the worker answering).
+        """
+        stats = registry.stats()
+        stats["result_cache"] = cache.stats() if cache is not None else None
+        return jsonify(stats)
+
+    # Headless JSON aggregates under /api/v1
+    register_api(app.server, registry, cache=cache)
+
+    @app.server.route("/export")
+    def export():
+        """
+        Streams the rows matching the filters (?ship=&segment=&state=&month=&week=,
+        repeatable) as CSV or Parquet (?format=). Rows are written chunk by chunk,
+        so the response starts right away and memory stays bounded.
+        """
+        file_format = request.args.get("format", "csv")
+        if file_format not in ("csv", "parquet"):
+            return jsonify(error=f"Unknown format: {file_format}"), 400
+        if file_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            return jsonify(error="Parquet export requires pyarrow"), 501
+        dataset = request.args.get("dataset") or registry.default
+        try:
+            loader = registry.get(dataset, timeout=0)
+        except KeyError:
+            return jsonify(error=f"Unknown dataset: {dataset}"), 404
+        if not loader.ready:
+            return jsonify(loader.status()), 503
+        if loader.data.source_changed():
+            # Rows are streamed from the file and matched to the loaded data
+            return jsonify(error=f"Dataset {dataset} changed since it was loaded"), 409
+        filters = normalized_filters(request.args)
+        filters = [filters.get(i) for i in filter_params]
+        if file_format == "csv":
+            body = loader.data.export_csv(*filters)
+            mimetype = "text/csv"
+        else:
+            body = loader.data.export_parquet(*filters)
+            mimetype = "application/vnd.apache.parquet"
+        return Response(
+            body,
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": f'attachment; filename="{dataset}.{file_format}"'
+            },
+        )
+
+    @app.callback(
+        Output("url", "search"),
+        Output("dataset-select", "value"),
+        Input("url", "search"),
+        Input("dataset-select", "value"),
+    )
+    def sync_dataset(search, dataset):
+        """
+        Keeps the dataset selector and the ?dataset= URL parameter in sync.
+        :return: The URL query string and the selected dataset.
+        """
+        query = parse_qs((search or "").lstrip("?"))
+        if ctx.triggered_id == "dataset-select":
+            query["dataset"] = [dataset]
+            return "?" + urlencode(query, doseq=True), no_update
+        requested = query.get("dataset", [None])[0]
+        if requested not in registry.paths or requested == dataset:
+            raise PreventUpdate
+        return search, requested
+
+    @app.callback(
+        Output("filter-ship", "value"),
+        Output("filter-segment", "value"),
+        Output("filter-state", "value"),
+        Output("filter-month", "value"),
+        Output("filter-week", "value"),
+        Input("dataset-select", "value"),
+        prevent_initial_call=True,
     )
+    def reset_filters(dataset):
+        """
+        Clears the filters when another dataset is selected.
+        """
+        return None, None, None, None, None
+
+    card_ids = [
+        "avg_shipping",
+        "shipping_modes",
+        "order_by_segment",
+        "order_by_location",
+        "order_by_city",
+        "order_timeline",
+        "order_trends",
+    ]
+    filter_inputs = [
+        Input("filter-ship", "value"),  # ID from element, variable
+        Input("filter-segment", "value"),
+        Input("filter-state", "value"),
+        Input("filter-month", "value"),
+        Input("filter-week", "value"),
+        Input("dataset-select", "value"),
+    ]
+
+    def cards_key(loader, filters):
+        """
+        :return: Result cache key of the cards of a filter selection
+        """
+        return cache.key("cards", loader.data.version, normalize_filters(*filters))
+
+    def render_cards(loader, filters):
+        """
+        Computes the cards of a filter selection, through the result cache.
+        :return: A tuple of Dash components (graphs) reflecting the filtered data.
+        """
+
+        def compute():
+            report_progress(1)
+            filtered = data_copy(loader.data, *filters)
+            report_progress(2)
+            cards = [
+                components.avg_shipping(filtered),
+                components.shipping_modes(filtered),
+                components.order_by_segment(filtered),
+                components.order_by_location(filtered),
+                components.order_by_city(filtered),
+            ]
+            report_progress(3)
+            cards += [
+                components.order_timeline(filtered),
+                components.order_trends(filtered),
+            ]
+            return tuple(cards)
+
+        if cache is None:
+            return compute()
+        return tuple(cache.get_or_compute(cards_key(loader, filters), compute))
+
+    # Callback function
+    # Register all interactive callbacks for the dashboard
+    @app.callback(
+        *[Output(i, "children") for i in card_ids],
+        Output("filter-job", "data"),
+        *filter_inputs,
+        Input("dataset-loaded", "data"),
+        # The unfiltered cards are already embedded in the layout
+        prevent_initial_call=True,
+    )
+    # This connects the UI filters with chart updates
+    def update_output(
+        ship_value, segment_value, state_value, month_value, week_value, dataset, loaded
+    ):
+        """
+        Updates all dashboard visual components based on user-selected filters.
+        Prerendered and cached cards are returned right away; other selections
+        are handed to the background job through the filter-job store.
+        :param ship_value: Selected shipping modes.
+        :param segment_value: elected customer segments.
+        :param state_value: Selected states.
+        :param month_value: Selected months.
+        :param week_value: Selected weekdays.
+        :param dataset: Selected dataset.
+        :param loaded: Set by poll_dataset once the selected dataset is loaded.
+        :return: A tuple of Dash components (graphs) reflecting the updated data,
+                 and the background job to run (if any).
+        """
+        loader = ready_loader(dataset)
+        if loader is None:
+            return (no_update,) * (len(card_ids) + 1)
+        filters = [ship_value, segment_value, state_value, month_value, week_value]
+        if not any(filters):
+            # All filters cleared: reuse the prerendered unfiltered cards
+            cards = json.loads(loader.extra)
+            return *[cards[i] for i in card_ids], no_update
+        if manager is None:
+            return *render_cards(loader, filters), no_update
+        cards = cache.get(cards_key(loader, filters)) if cache is not None else None
+        if cards is not None:
+            return *cards, no_update
+        return *[no_update] * len(card_ids), {"dataset": dataset, "filters": filters}
+
+    if manager is not None:
+
+        @app.callback(
+            *[Output(i, "children", allow_duplicate=True) for i in card_ids],
+            Input("filter-job", "data"),
+            prevent_initial_call=True,
+            # Heavy selections run as a background job, keeping the worker free;
+            # a job still running when the filters change again is terminated.
+            background=True,
+            interval=250,
+            running=[
+                (
+                    Output("filter-status", "style"),
+                    {"visibility": "visible"},
+                    {"visibility": "hidden"},
+                ),
+            ],
+            cancel=filter_inputs,
+        )
+        def run_filter_job(job):
+            """
+            Computes the cards of a selection that was not in the result cache.
+            :param job: dict with the dataset and the filter values
+            :return: A tuple of Dash components (graphs) reflecting the filtered data.
+            """
+            if not job:
+                raise PreventUpdate
+            # A job process can wait for the dataset: it holds no web worker
+            loader = registry.get(job["dataset"])
+            if not loader.ready:
+                raise PreventUpdate
+            return render_cards(loader, job["filters"])
+
+    @app.callback(
+        Output("filter-ship", "options"),
+        Output("filter-segment", "options"),
+        Output("filter-state", "options"),
+        Output("filter-month", "options"),
+        Output("filter-week", "options"),
+        Input("filter-ship", "value"),
+        Input("filter-segment", "value"),
+        Input("filter-state", "value"),
+        Input("filter-month", "value"),
+        Input("filter-week", "value"),
+        Input("dataset-select", "value"),
+        Input("dataset-loaded", "data"),
+        # The unfiltered counts are already in the layout
+        prevent_initial_call=True,
+    )
+    def update_facets(
+        ship_value, segment_value, state_value, month_value, week_value, dataset, loaded
+    ):
+        """
+        Refreshes the order count shown next to every dropdown option,
+        given the other active filters.
+        :return: A tuple with the options of the five filter dropdowns.
+        """
+        loader = ready_loader(dataset)
+        if loader is None:
+            return (no_update,) * 5
+        counts = loader.data.facet_counts(
+            ship_value, segment_value, state_value, month_value, week_value
+        )
+        return tuple(components.filter_options(loader.data, counts))
+
+    @app.callback(
+        Output("timeline-graph", "figure"),
+        Input("timeline-graph", "relayoutData"),
+        State("filter-ship", "value"),
+        State("filter-segment", "value"),
+        State("filter-state", "value"),
+        State("filter-month", "value"),
+        State("filter-week", "value"),
+        State("dataset-select", "value"),
+        prevent_initial_call=True,
+    )
+    def zoom_timeline(
+        relayout,
+        ship_value,
+        segment_value,
+        state_value,
+        month_value,
+        week_value,
+        dataset,
+    ):
+        """
+        Re-resamples the time series for the visible range when the user zooms,
+        so zooming in shows daily detail instead of the downsampled overview.
+        :return: The time-series figure for the visible range.
+        """
+        x_range = components.timeline_range(relayout)
+        if x_range is False:
+            raise PreventUpdate
+        loader = ready_loader(dataset)
+        if loader is None:
+            return no_update
+        filtered = loader.data.filtered(
+            ship_value, segment_value, state_value, month_value, week_value
+        )
+        return components.time_series(filtered.daily_orders(), x_range)
+
+    @app.callback(
+        Output("dataset-poll", "disabled"),
+        Output("dataset-loaded", "data"),
+        Input("dataset-poll", "n_intervals"),
+        State("dataset-select", "value"),
+        prevent_initial_call=True,
+    )
+    def poll_dataset(n_intervals, dataset):
+        """
+        Follows a dataset selected while it was still loading, showing its
+        progress in the filter bar. Once it is loaded, stops polling and re-runs
+        the callbacks that needed it (through the dataset-loaded store).
+        :return: Whether to stop polling, and the new dataset-loaded value.
+        """
+        try:
+            loader = registry.loader(dataset)
+        except KeyError:
+            return True, no_update
+        if loader.state == "loading":
+            set_props("filter-status", {"style": {"visibility": "visible"}})
+            set_props("filter-progress", {"value": loader.progress, "max": 1})
+            return no_update, no_update
+        set_props("filter-status", {"style": {"visibility": "hidden"}})
+        return True, n_intervals
+
+    @app.callback(
+        Output("export-csv", "href"),
+        Output("export-parquet", "href"),
+        Input("filter-ship", "value"),
+        Input("filter-segment", "value"),
+        Input("filter-state", "value"),
+        Input("filter-month", "value"),
+        Input("filter-week", "value"),
+        Input("dataset-select", "value"),
+        prevent_initial_call=True,
+    )
+    def update_export_links(
+        ship_value, segment_value, state_value, month_value, week_value, dataset
+    ):
+        """
+        Points the download links at the current selection.
+        :return: The CSV and Parquet export URLs.
+        """
+        filters = [ship_value, segment_value, state_value, month_value, week_value]
+        return (
+            components.export_href("csv", dataset, *filters),
+            components.export_href("parquet", dataset, *filters),
+        )
+
+    if warm_up:
+        registry.loader()
+    return app
+
+
+def __getattr__(name):
+    """
+    Builds the default app the first time `app` or `server` is accessed
+    (e.g. `gunicorn dash_app:server`), so importing this module has no side effects.
+    """
+    if name in ("app", "server"):
+        app = create_app()
+        globals().update(app=app, server=app.server)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -5,10 +5,19 @@ Defines the SuperstoreData class responsible for loading and preprocessing
 the sales dataset used in the dashboard.
 """
 
+import numpy as np
 import pandas as pd
 
 # https://stackoverflow.com/questions/66831999/how-to-import-csv-as-a-pandas-dataframe
+import io
+import importlib.util
 import os
+import glob
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
 
 # Dictionary mapping U.S. state names to their standard two-letter postal abbreviations.
 us_state_abbrev = {
@@ -65,6 +74,45 @@ us_state_abbrev = {
     "Wyoming": "WY",
 }
 
+# Columns behind the five dashboard filters, in filter-bar order.
+facet_columns = ["Ship_Mode", "Segment", "State", "Order_Month", "Order_Weekday"]
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the points that best
+    preserve the visual shape of a line chart.
+    https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+    :param x: Numeric x values, sorted
+    :param y: y values
+    :param threshold: Number of points to keep
+    :return: numpy array with the positions of the kept points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    # First and last points are kept; the rest is split into threshold - 2 buckets
+    edges = np.floor(np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(int)
+    edges += 1  # edges[-1] == n - 1, the last point
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        # Area of the triangle formed with the previous point and the next bucket average
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
 
 def data_copy(old_obj, ship_value, segment_value, state_value, month_value, week_value):
     """
@@ -79,7 +127,7 @@ def data_copy(old_obj, ship_value, segment_value, state_value, month_value, week
     """
     if not hasattr(old_obj, "df") or old_obj.df is None or old_obj.df.empty:
         print("Empty original DataFrame. data_copy will return an empty Data.")
-        return Data(old_obj.path)
+        return Data()
 
     new_obj = Data()
     new_obj.df = old_obj.df.copy()
@@ -107,6 +155,7 @@ def data_copy(old_obj, ship_value, segment_value, state_value, month_value, week
     new_obj.orders_per_week_info = new_obj.orders_per_week()
     new_obj.orders_per_state_info = new_obj.orders_per_state()
     new_obj.orders_per_city_info = new_obj.orders_per_city()
+    new_obj.city_markers_info = new_obj.city_markers()
 
     return new_obj
 
@@ -116,26 +165,33 @@ class Data:
     Class to load and preprocess the Superstore dataset for analysis.
     """
 
-    def __init__(self, in_path=None):
+    def __init__(self, in_path=None, progress=None):
         """
         Initializes the data loader with the path to the CSV file.
 
         :Args: file_path (str): Relative path to the CSV file.
+               progress (callable, optional): Called as progress(stage, fraction)
+               while the dataset is being loaded.
         """
         self.path = in_path
+        self.error = None
+        self.version = None
+        report = progress or (lambda stage, fraction: None)
+        if in_path is None:
+            # Bare container, filled in by data_copy()
+            self.df = pd.DataFrame()
+            self.empty_summaries()
+            return
+        report("Reading CSV", 0.0)
         self.df = self.get_data()
         if self.df is None or self.df.empty:
             print(
                 "Data could not be loaded. The Data instance will have an empty DataFrame."
             )
-            self.avg_shipping_info = None
-            self.ship_modes_info = pd.DataFrame()
-            self.orders_per_segment_info = pd.DataFrame()
-            self.orders_per_month_info = pd.DataFrame()
-            self.orders_per_week_info = pd.DataFrame()
-            self.orders_per_state_info = pd.DataFrame()
-            self.orders_per_city_info = pd.DataFrame()
+            self.empty_summaries()
             return
+        self.version = self.get_version()
+        report("Parsing dates", 0.6)
         self.df["Ship_Date"] = (
             (self.get_datetime("Ship_Date"))
             if ("Ship_Date" in self.df.columns)
@@ -149,6 +205,7 @@ class Data:
         self.df["Shipping_Time"] = (
             self.df["Ship_Date"] - self.df["Order_Date"]
         ).dt.days
+        report("Computing summaries", 0.8)
         self.avg_shipping_info = self.shipping_time()
         self.ship_modes_info = self.shipping_by_mode()
         self.orders_per_segment_info = self.orders_per_segment()
@@ -160,24 +217,385 @@ class Data:
         self.orders_per_week_info = self.orders_per_week()
         self.orders_per_state_info = self.orders_per_state()
         self.orders_per_city_info = self.orders_per_city()
+        self.add_coordinates()
+        self.city_markers_info = self.city_markers()
+        self.encode_facets()
+        report("Ready", 1.0)
+
+    def encode_facets(self):
+        """
+        Encodes every filter column as integer codes, once at load time, so
+        facet_counts() works on numpy arrays instead of strings.
+        """
+        self.facet_values = {}
+        codes = []
+        offset = 0
+        for column in facet_columns:
+            column_codes, uniques = pd.factorize(self.df[column], use_na_sentinel=False)
+            self.facet_values[column] = pd.Index(uniques)
+            # Shift each column into its own slice of one shared code space
+            codes.append(column_codes + offset)
+            offset += len(uniques)
+        self.facet_matrix = np.vstack(codes)
+        self.facet_size = offset
+
+    def filter_fails(
+        self,
+        ship_value,
+        segment_value,
+        state_value,
+        month_value,
+        week_value,
+        start=0,
+        stop=None,
+    ):
+        """
+        Evaluates the five filters on the encoded facet codes.
+        :param start: First row position to evaluate
+        :param stop: Row position to stop at (defaults to the end)
+        :return: Boolean array (5 x rows), True where a row fails that filter
+        """
+        selections = [ship_value, segment_value, state_value, month_value, week_value]
+        matrix = self.facet_matrix[:, start:stop]
+        fails = np.zeros(matrix.shape, dtype=bool)
+        offset = 0
+        for i, (column, selected) in enumerate(zip(facet_columns, selections)):
+            values = self.facet_values[column]
+            if selected:
+                allowed = np.zeros(self.facet_size, dtype=bool)
+                index = values.get_indexer(selected)
+                allowed[index[index >= 0] + offset] = True
+                fails[i] = ~allowed[matrix[i]]
+            offset += len(values)
+        return fails
+
+    def facet_counts(
+        self, ship_value, segment_value, state_value, month_value, week_value
+    ):
+        """
+        Cascading facet counts: for each filter, the number of orders per option
+        given the selections of the *other* four filters.
+
+        A row counts towards a facet if it passes every other filter, i.e. it fails
+        no filter, or fails only that facet's own filter. All five facets are then
+        counted together with a single bincount over the shared code space.
+        :return: dict mapping each facet column to a Series of counts per value
+        """
+        fails = self.filter_fails(
+            ship_value, segment_value, state_value, month_value, week_value
+        )
+        failed_filters = fails.sum(axis=0)
+        weights = (failed_filters == 0) | ((failed_filters == 1) & fails)
+        counts = np.bincount(
+            self.facet_matrix.ravel(),
+            weights=weights.ravel(),
+            minlength=self.facet_size,
+        ).astype(int)
+        result = {}
+        offset = 0
+        for column in facet_columns:
+            values = self.facet_values[column]
+            result[column] = pd.Series(
+                counts[offset : offset + len(values)], index=values
+            )
+            offset += len(values)
+        return result
+
+    def daily_orders(self):
+        """
+        Resamples the orders to one row per calendar day (days without orders
+        count as 0), with 7 and 30 day rolling averages.
+        :return: DataFrame indexed by date with Orders, Sales and their rolling means
+        """
+        columns = ["Orders", "Sales"]
+        if self.df.empty:
+            daily = pd.DataFrame(
+                {
+                    "Orders": pd.Series(dtype="int64"),
+                    "Sales": pd.Series(dtype="float64"),
+                },
+                index=pd.DatetimeIndex([], name="Order_Date"),
+            )
+        else:
+            daily = (
+                self.df.set_index("Order_Date")
+                .resample("D")
+                .agg(Orders=("Sales", "size"), Sales=("Sales", "sum"))
+            )
+        for column in columns:
+            for days in (7, 30):
+                daily[f"{column}_{days}d"] = (
+                    daily[column].rolling(days, min_periods=1).mean()
+                )
+        return daily
+
+    def filtered(self, ship_value, segment_value, state_value, month_value, week_value):
+        """
+        Filters on the encoded facet codes, without computing any summary
+        (unlike data_copy); call the summary methods you need on the result.
+        :return: A new Data object containing only the matching rows
+        """
+        fails = self.filter_fails(
+            ship_value, segment_value, state_value, month_value, week_value
+        )
+        new_obj = Data()
+        new_obj.df = self.df[~fails.any(axis=0)]
+        new_obj.version = self.version
+        return new_obj
+
+    def iter_filtered(
+        self,
+        ship_value,
+        segment_value,
+        state_value,
+        month_value,
+        week_value,
+        chunk_size=50_000,
+    ):
+        """
+        Yields the rows matching the filters, with every column of the source
+        CSV, streamed from the file (see iter_source) without building the whole
+        filtered DataFrame. Rows are matched on the facet codes of the loaded
+        data, so the file must not have changed since (see source_changed).
+        :return: Generator of DataFrames with the original CSV columns
+        """
+        start = 0
+        for chunk in self.iter_source(chunk_size):
+            stop = start + len(chunk)
+            fails = self.filter_fails(
+                ship_value,
+                segment_value,
+                state_value,
+                month_value,
+                week_value,
+                start,
+                stop,
+            )
+            start = stop
+            yield chunk.loc[~fails.any(axis=0)]
+
+    def export_csv(self, *filters, chunk_size=50_000):
+        """
+        Streams the filtered rows as CSV.
+        :param filters: ship, segment, state, month and week values, as in data_copy
+        :return: Generator of CSV text chunks (the first one has the header)
+        """
+        header = True
+        for chunk in self.iter_filtered(*filters, chunk_size=chunk_size):
+            if chunk.empty and not header:
+                continue
+            yield chunk.to_csv(index=False, header=header, date_format="%d/%m/%Y")
+            header = False
+
+    def export_parquet(self, *filters, chunk_size=50_000):
+        """
+        Streams the filtered rows as Parquet, one row group per chunk.
+        Requires pyarrow (optional dependency).
+        :param filters: ship, segment, state, month and week values, as in data_copy
+        :return: Generator of Parquet bytes
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        parquet_types = {
+            "int64": pa.int64(),
+            "Int64": pa.int64(),
+            "float64": pa.float64(),
+            "str": pa.string(),
+            "date": pa.timestamp("ns"),
+        }
+        # Declared up front: an empty first chunk would give untyped columns
+        schema = pa.schema(
+            [(k, parquet_types[v]) for k, v in self.source_schema().items()]
+        )
+        sink = _StreamSink()
+        with pq.ParquetWriter(sink, schema) as writer:
+            for chunk in self.iter_filtered(*filters, chunk_size=chunk_size):
+                if chunk.empty:
+                    continue
+                writer.write_table(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                )
+                yield sink.drain()
+        yield sink.drain()
+
+    def memory_usage(self):
+        """
+        :return: Approximate memory held by the dataset, in bytes
+        """
+        total = int(self.df.memory_usage(deep=True).sum())
+        if hasattr(self, "facet_matrix"):
+            total += self.facet_matrix.nbytes
+        return total
+
+    def empty_summaries(self):
+        """
+        Resets every summary attribute to an empty value.
+        """
+        self.avg_shipping_info = None
+        self.ship_modes_info = pd.DataFrame()
+        self.orders_per_segment_info = pd.DataFrame()
+        self.orders_per_month_info = pd.DataFrame()
+        self.orders_per_week_info = pd.DataFrame()
+        self.orders_per_state_info = pd.DataFrame()
+        self.orders_per_city_info = pd.DataFrame()
+        self.city_markers_info = pd.DataFrame()
 
     def get_data(self):
         """
-        Read CSV file
+        Read CSV file (only the columns in csv_schema, already typed)
         :return: DataFrame
         """
         try:
-            df = pd.read_csv(
-                csv_file, encoding="ISO-8859-1"
-            )  # alternative encoding with special characters
-            return df
+            if importlib.util.find_spec("pyarrow") is not None:
+                return self.read_csv_arrow()
+            return self.read_csv_pandas()
         except FileNotFoundError:
-            print(f'Error: CSV file not found in "{self.path}" ')
+            self.error = f'CSV file not found in "{self.path}"'
+            print(f"Error: {self.error} ")
             return pd.DataFrame()  # Empty DataFrame
         except Exception as e:
-            print(f'Error reading "{self.path}": {e}')
+            self.error = f'Error reading "{self.path}": {e}'
+            print(self.error)
             return pd.DataFrame()  # Empty DataFrame
 
+    def read_csv_arrow(self):
+        """
+        Multi-threaded parse with the pyarrow CSV reader: dates are parsed and
+        categories dictionary-encoded during the read.
+        https://arrow.apache.org/docs/python/csv.html
+        :return: DataFrame
+        """
+        import pyarrow.csv as pa_csv
+
+        read_options, convert_options = self.arrow_options(csv_schema)
+        table = pa_csv.read_csv(
+            self.path, read_options=read_options, convert_options=convert_options
+        )
+        return self.arrow_to_pandas(table, csv_schema)
+
+    def read_csv_pandas(self):
+        """
+        Fallback parse with pandas when pyarrow is not installed (single
+        threaded, slower than the pyarrow reader).
+        :return: DataFrame
+        """
+        df = pd.read_csv(self.path, **self.pandas_options(csv_schema))
+        for column in [k for k, v in csv_schema.items() if v == "category"]:
+            if column in df.columns:
+                # Categories in order of appearance, like the pyarrow dictionaries
+                df[column] = pd.Categorical.from_codes(*pd.factorize(df[column]))
+        return df
+
+    @staticmethod
+    def arrow_options(schema):
+        """
+        :param schema: dict of column -> type, as in csv_schema
+        :return: pyarrow ReadOptions and ConvertOptions reading those columns
+        """
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+
+        arrow_types = {
+            "int64": pa.int64(),
+            "Int64": pa.int64(),
+            "float64": pa.float64(),
+            "str": pa.string(),
+            "category": pa.dictionary(pa.int32(), pa.string()),
+            "date": pa.timestamp("s"),
+        }
+        read_options = pa_csv.ReadOptions(
+            encoding="ISO-8859-1", use_threads=True
+        )  # alternative encoding with special characters
+        convert_options = pa_csv.ConvertOptions(
+            column_types={k: arrow_types[v] for k, v in schema.items()},
+            include_columns=list(schema),
+            include_missing_columns=True,
+            timestamp_parsers=[date_format],
+        )
+        return read_options, convert_options
+
+    @staticmethod
+    def arrow_to_pandas(table, schema):
+        """
+        :param table: pyarrow Table or RecordBatch read with arrow_options(schema)
+        :param schema: dict of column -> type, as in csv_schema
+        :return: DataFrame with the pandas types of the schema
+        """
+        df = table.to_pandas(coerce_temporal_nanoseconds=True)
+        # Integer columns with missing values come back as float64
+        nullable = [k for k, v in schema.items() if v == "Int64" and k in df.columns]
+        return df.astype(dict.fromkeys(nullable, "Int64"))
+
+    @staticmethod
+    def pandas_options(schema):
+        """
+        :param schema: dict of column -> type, as in csv_schema
+        :return: Keyword arguments of pd.read_csv reading those columns
+        """
+        return {
+            "encoding": "ISO-8859-1",  # alternative encoding with special characters
+            "usecols": lambda column: column in schema,
+            "dtype": {
+                k: (object if v in ("str", "category") else v)
+                for k, v in schema.items()
+                if v != "date"
+            },
+            "parse_dates": [k for k, v in schema.items() if v == "date"],
+            "date_format": date_format,
+        }
+
+    def source_schema(self):
+        """
+        :return: dict of every column of the source CSV (in file order) -> type.
+                 Columns outside csv_schema, and categories, are read as text.
+        """
+        header = pd.read_csv(self.path, encoding="ISO-8859-1", nrows=0)
+        types = {i: csv_schema.get(i, "str") for i in header.columns}
+        return {k: ("str" if v == "category" else v) for k, v in types.items()}
+
+    def iter_source(self, chunk_size=50_000):
+        """
+        Streams every column of the source CSV, in file order. The loaded
+        DataFrame only holds the columns in csv_schema; this is how /export
+        gets the others. With pyarrow the file is read one block (about 1 MB) at
+        a time, with pandas chunk_size rows at a time.
+        :return: Generator of DataFrames
+        """
+        schema = self.source_schema()
+        if importlib.util.find_spec("pyarrow") is None:
+            with pd.read_csv(
+                self.path, chunksize=chunk_size, **self.pandas_options(schema)
+            ) as reader:
+                yield from reader
+            return
+        import pyarrow.csv as pa_csv
+
+        read_options, convert_options = self.arrow_options(schema)
+        with pa_csv.open_csv(
+            self.path, read_options=read_options, convert_options=convert_options
+        ) as reader:
+            for batch in reader:
+                yield self.arrow_to_pandas(batch, schema)
+
+    def source_changed(self):
+        """
+        :return: True if the CSV file changed since it was loaded
+        """
+        try:
+            return self.get_version() != self.version
+        except OSError:
+            return True
+
+    def get_version(self):
+        """
+        Identifies the loaded file, so cached results can be tied to it.
+        :return: Short hash of the path, size and modification time of the CSV
+        """
+        stat = os.stat(self.path)
+        key = f"{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
     def get_info(self):
         """
         Principal info about DataFrame
@@ -191,7 +609,9 @@ class Data:
         :param column: Name of the column with dates
         :return: pandas datetime format
         """
-        return pd.to_datetime(self.df[column], format="%d/%m/%Y")
+        if pd.api.types.is_datetime64_any_dtype(self.df[column]):
+            return self.df[column]  # already parsed while reading
+        return pd.to_datetime(self.df[column], format=date_format)
 
     def shipping_time(self):
         """
@@ -205,7 +625,11 @@ class Data:
         Group data by Ship Mode
         :return: DataFrame with Ship Mode and avg
         """
-        modes = self.df.groupby("Ship_Mode")["Shipping_Time"].mean().sort_values()
+        modes = (
+            self.df.groupby("Ship_Mode", observed=True)["Shipping_Time"]
+            .mean()
+            .sort_values()
+        )
         # https: // stackoverflow.com / questions / 10373660 / converting - a - pandas - groupby - multiindex - output -from-series - back - to - dataframe
         return modes.reset_index()
 
@@ -213,8 +637,7 @@ class Data:
         """
         :return: DataFrame with Client's Segments and Clients per Segment
         """
-        count = self.df["Segment"].value_counts()
-        return count.reset_index()
+        return self.count_values("Segment")
 
     def orders_per_month(self):
         """
@@ -284,7 +707,7 @@ class Data:
         Calculates the number of orders per state.
         :return: DataFrame with states and order counts
         """
-        count = self.df["State"].value_counts().reset_index()
+        count = self.count_values("State")
         # https: // www.geeksforgeeks.org / python - map - function /
         count["State_Code"] = count["State"].map(us_state_abbrev)
         return count.rename(columns={"count": "Order_Count"})
@@ -294,12 +717,397 @@ class Data:
         Calculates the number of orders per city.
         :return: DataFrame with cities and order counts
         """
-        count = self.df["City"].value_counts().reset_index()
+        count = self.count_values("City")
         return count.rename(columns={"count": "Order_Count"})
 
+    def count_values(self, column):
+        """
+        Counts the orders per value of a column, most orders first. Ties are
+        ordered by value, so the result does not depend on the category order.
+        :param column: Column name
+        :return: DataFrame with the values (as str) and a count column
+        """
+        count = self.df[column].value_counts()
+        # Categorical columns list every category, including the empty ones
+        count = count[count > 0].reset_index()
+        count[column] = count[column].astype(str)
+        return count.sort_values(
+            ["count", column], ascending=[False, True], ignore_index=True
+        )
+
+    def add_coordinates(self):
+        """
+        Adds numeric Latitude/Longitude columns from the bundled offline lookup
+        (centroids of every US ZIP code). Rows are matched on Postal_Code, falling
+        back to the centroid of the ZIP codes of their City and State.
+        """
+        try:
+            lookup = pd.read_csv(postal_codes_file, dtype={"Postal_Code": str})
+        except Exception as e:
+            print(f'Error reading "{postal_codes_file}": {e}')
+            self.df["Latitude"] = np.nan
+            self.df["Longitude"] = np.nan
+            return
+        codes = self.df["Postal_Code"].astype("Int64").astype(str).str.zfill(5)
+        by_code = lookup.set_index("Postal_Code")
+        latitude = codes.map(by_code["Latitude"])
+        longitude = codes.map(by_code["Longitude"])
+        missing = latitude.isna()
+        if missing.any():
+            by_city = lookup.groupby(["City", "State"])[
+                ["Latitude", "Longitude"]
+            ].mean()
+            keys = pd.MultiIndex.from_frame(
+                self.df.loc[missing, ["City", "State"]].astype(str)
+            )
+            latitude[missing] = by_city["Latitude"].reindex(keys).to_numpy()
+            longitude[missing] = by_city["Longitude"].reindex(keys).to_numpy()
+        unresolved = int(latitude.isna().sum())
+        if unresolved:
+            # These rows are left off the city map
+            print(
+                f'{unresolved} of {len(self.df)} rows in "{self.path}" could not be located'
+            )
+        self.df["Latitude"] = latitude.astype("float32")
+        self.df["Longitude"] = longitude.astype("float32")
+
+    def city_markers(self, max_points=300):
+        """
+        Aggregates orders into weighted map markers, one per location. If there
+        are more than max_points locations they are snapped to a lat/lon grid,
+        doubling the cell size until they fit, so the figure size stays bounded.
+        :param max_points: Maximum number of markers returned
+        :return: DataFrame with Latitude, Longitude, Order_Count, Sales and Label
+        """
+        # Typed, so an empty selection still plots (as an empty map)
+        empty = pd.DataFrame(
+            {
+                "Latitude": pd.Series(dtype="float64"),
+                "Longitude": pd.Series(dtype="float64"),
+                "Order_Count": pd.Series(dtype="int64"),
+                "Sales": pd.Series(dtype="float64"),
+                "Label": pd.Series(dtype="object"),
+            }
+        )
+        if "Latitude" not in self.df.columns:
+            return empty
+        df = self.df.dropna(subset=["Latitude", "Longitude"])
+        if df.empty:
+            return empty
+        # Busiest cities first, so "first" names each cluster after its largest city
+        city_size = df.groupby("City", observed=True)["City"].transform("size")
+        df = df.iloc[np.argsort(-city_size.to_numpy(), kind="stable")]
+        latitude = df["Latitude"].to_numpy(dtype="float64")
+        longitude = df["Longitude"].to_numpy(dtype="float64")
+        cell = 0.0
+        while True:
+            if cell:
+                keys = [np.floor(latitude / cell), np.floor(longitude / cell)]
+            else:
+                keys = [latitude, longitude]
+            groups = df.groupby(keys, sort=False)
+            if groups.ngroups <= max_points:
+                break
+            cell = cell * 2 if cell else 0.25
+        markers = groups.agg(
+            Order_Count=("City", "size"),
+            Sales=("Sales", "sum"),
+            Latitude=("Latitude", "mean"),
+            Longitude=("Longitude", "mean"),
+            Label=("City", "first"),
+            Cities=("City", "nunique"),
+        ).reset_index(drop=True)
+        markers["Label"] = markers["Label"].astype(str)
+        # Name clusters after one of their cities
+        more = markers["Cities"] > 1
+        markers.loc[more, "Label"] = (
+            markers.loc[more, "Label"]
+            + " + "
+            + (markers.loc[more, "Cities"] - 1).astype(str)
+            + " more"
+        )
+        return markers[list(empty.columns)].sort_values("Order_Count", ascending=False)
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    Write-only file object that hands the written bytes back through drain(),
+    so a ParquetWriter can be streamed chunk by chunk.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        """
+        :return: The bytes written since the last call
+        """
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+
+class DataLoader:
+    """
+    Loads a Data object in a background thread and reports its progress,
+    so the web server can start before the dataset is in memory.
+    """
+
+    # Shared by every loader: plotly figures (built by on_ready) are not safe
+    # to build from several threads at once
+    _on_ready_lock = threading.Lock()
+
+    def __init__(self, in_path=None, on_ready=None):
+        """
+        :param in_path: Path to the CSV file. Nothing is read until start() is called.
+        :param on_ready: Optional callable run in the loader thread with the loaded
+                         Data object before the loader reports ready; its return
+                         value is kept in self.extra (e.g. prerendered components).
+                         Return it serialized (str/bytes) so that it is counted
+                         in self.memory.
+        """
+        self.path = in_path or csv_file
+        self.on_ready = on_ready
+        self.data = None
+        self.extra = None
+        self.state = "pending"  # pending -> loading -> ready | failed
+        self.stage = None
+        self.progress = 0.0
+        self.error = None
+        self.load_seconds = None
+        self.memory = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts loading in a daemon thread. Calling it again is a no-op.
+        :return: self
+        """
+        with self._lock:
+            if self._thread is None:
+                self.state = "loading"
+                self._thread = threading.Thread(
+                    target=self._load, name="data-loader", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def _load(self):
+        """
+        Thread target: builds the Data object and records the outcome.
+        """
+        started = time.perf_counter()
+        try:
+            obj = Data(self.path, progress=self._report)
+        except Exception as e:
+            self.error = f"Error loading {self.path}: {e}"
+            self.state = "failed"
+            print(self.error)
+            return
+        if obj.df is None or obj.df.empty:
+            self.error = obj.error or f'No rows loaded from "{self.path}"'
+            self.state = "failed"
+            return
+        if self.on_ready is not None:
+            self._report("Prerendering", 0.9)
+            try:
+                with self._on_ready_lock:
+                    self.extra = self.on_ready(obj)
+            except Exception as e:
+                self.error = f"Error preparing {self.path}: {e}"
+                self.state = "failed"
+                print(self.error)
+                return
+            self._report("Ready", 1.0)
+        self.load_seconds = time.perf_counter() - started
+        self.memory = obj.memory_usage()
+        if isinstance(self.extra, (str, bytes)):
+            self.memory += sys.getsizeof(self.extra)
+        self.data = obj
+        self.state = "ready"
+
+    def _report(self, stage, fraction):
+        """
+        Progress callback passed to Data.
+        """
+        self.stage = stage
+        self.progress = fraction
+
+    def wait(self, timeout=None):
+        """
+        Blocks until loading has finished (or the timeout expires).
+        :return: The Data object, or None if it is not ready.
+        """
+        self.start()
+        self._thread.join(timeout)
+        return self.data
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def status(self):
+        """
+        :return: dict describing the loading state, used by the readiness probe
+        """
+        return {
+            "state": self.state,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "memory_bytes": self.memory,
+        }
+
+
+class DatasetRegistry:
+    """
+    Serves several datasets from one process. Datasets are loaded lazily on
+    first use and the least recently used ones are evicted once the loaded
+    datasets exceed the memory budget (the default dataset is never evicted).
+    """
+
+    def __init__(self, datasets, memory_budget=512 * 2**20, on_ready=None):
+        """
+        :param datasets: dict mapping dataset name to CSV path. The first one is the default.
+        :param memory_budget: Maximum memory (bytes) kept by the loaded datasets.
+        :param on_ready: Passed to every DataLoader (see DataLoader).
+        """
+        self.paths = dict(datasets)
+        if not self.paths:
+            raise ValueError("DatasetRegistry needs at least one dataset")
+        self.default = next(iter(self.paths))
+        self.memory_budget = memory_budget
+        self.on_ready = on_ready
+        self._loaders = OrderedDict()  # least recently used first
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, directory, **kwargs):
+        """
+        Registers every CSV file in a directory, named after the file.
+        :param directory: Folder with one CSV export per dataset
+        :return: DatasetRegistry
+        """
+        datasets = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*.csv"))):
+            if os.path.abspath(path) == os.path.abspath(postal_codes_file):
+                continue
+            datasets[os.path.splitext(os.path.basename(path))[0]] = path
+        return cls(datasets, **kwargs)
+
+    def names(self):
+        """
+        :return: list of registered dataset names
+        """
+        return list(self.paths)
+
+    def loader(self, name=None):
+        """
+        Returns the DataLoader for a dataset, starting it if needed, and marks
+        the dataset as most recently used.
+        :param name: Dataset name (defaults to the first registered dataset)
+        :return: DataLoader
+        """
+        name = name or self.default
+        if name not in self.paths:
+            raise KeyError(f"Unknown dataset: {name}")
+        with self._lock:
+            loader = self._loaders.get(name)
+            if loader is None:
+                loader = DataLoader(self.paths[name], on_ready=self.on_ready)
+                self._loaders[name] = loader
+            self._loaders.move_to_end(name)
+            self._last_used[name] = time.time()
+        return loader.start()
+
+    def get(self, name=None, timeout=None):
+        """
+        Returns the loaded dataset, waiting for it to load if necessary.
+        :param timeout: Seconds to wait for the load (None waits until it ends,
+                        0 returns right away); request handlers should not wait
+        :return: The DataLoader, ready unless loading failed or timed out
+        """
+        loader = self.loader(name)
+        loader.wait(timeout)
+        self.evict(keep=name or self.default)
+        return loader
+
+    def evict(self, keep=None):
+        """
+        Drops least recently used datasets until the loaded ones fit in the budget.
+        :param keep: Dataset that must not be evicted (the one being served)
+        :return: list of evicted dataset names
+        """
+        evicted = []
+        with self._lock:
+            total = sum(i.memory or 0 for i in self._loaders.values())
+            for name in list(self._loaders):
+                if total <= self.memory_budget:
+                    break
+                loader = self._loaders[name]
+                # The default dataset backs the layout and the readiness probe
+                if name in (keep, self.default) or loader.state == "loading":
+                    continue
+                total -= loader.memory or 0
+                del self._loaders[name]
+                evicted.append(name)
+        for name in evicted:
+            print(f"Evicted dataset {name} from memory")
+        return evicted
+
+    def stats(self):
+        """
+        :return: dict with the budget and the status of every registered dataset
+        """
+        with self._lock:
+            loaders = dict(self._loaders)
+        datasets = {}
+        for name in self.paths:
+            loader = loaders.get(name)
+            status = loader.status() if loader else {"state": "unloaded"}
+            status["last_used"] = self._last_used.get(name)
+            datasets[name] = status
+        return {
+            "memory_budget": self.memory_budget,
+            "memory_used": sum(i.memory or 0 for i in loaders.values()),
+            "datasets": datasets,
+        }
+
 
 csv_file = os.path.join("data", "superstore_final_dataset (1).csv")
 
-data = Data(csv_file)
+# Columns the dashboard reads from the CSV and their types. Unused columns
+# (Product_Name, Customer_Name, ...) are never parsed; /export streams them
+# from the file (Data.iter_source).
+csv_schema = {
+    "Row_ID": "int64",
+    "Order_ID": "str",
+    "Order_Date": "date",
+    "Ship_Date": "date",
+    "Ship_Mode": "category",
+    "Segment": "category",
+    "City": "category",
+    "State": "category",
+    "Postal_Code": "Int64",  # nullable: some rows have none
+    "Sales": "float64",
+}
+date_format = "%d/%m/%Y"
 
-filtered = data_copy(data, None, None, None, None, None)
+# Offline Postal_Code -> lat/lon lookup (US zip code centroids)
+postal_codes_file = os.path.join("data", "us_postal_codes.csv")
@@ -0,0 +1,134 @@
+"""
+json_api.py
+
+Versioned JSON API exposing the dashboard aggregates of the Data class,
+so other services do not have to go through the Dash callback protocol.
+
+Responses carry a strong ETag derived from the dataset version, the
+normalized filters and the code revision, so clients can revalidate with If-None-Match and get
+a 304 without the aggregates being recomputed.
+https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/ETag
+"""
+
+import hashlib
+import json
+
+from flask import Blueprint, current_app, jsonify, request
+
+from result_cache import cache_format, code_revision, filter_params, normalize_filters
+
+# Aggregate name in the URL -> Data method computing it
+aggregates = {
+    "shipping_time": "shipping_time",
+    "ship_modes": "shipping_by_mode",
+    "segments": "orders_per_segment",
+    "months": "orders_per_month",
+    "weekdays": "orders_per_week",
+    "states": "orders_per_state",
+    "cities": "orders_per_city",
+}
+
+api = Blueprint("api_v1", __name__, url_prefix="/api/v1")
+
+# Changes whenever a deploy may change the output, so old ETags stop matching
+output_version = [cache_format, code_revision()]
+
+
+def normalized_filters(args):
+    """
+    :param args: Request query arguments
+    :return: dict of filter name -> sorted unique values, as in normalize_filters
+    """
+    return normalize_filters(*[args.getlist(i) for i in filter_params])
+
+
+def make_etag(version, dataset, name, filters):
+    """
+    :return: Strong ETag for an aggregate of a given dataset version and filter set,
+             as computed by this revision of the code
+    """
+    key = json.dumps([*output_version, version, dataset, name, filters], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def to_json(result):
+    """
+    Converts an aggregate (Series or DataFrame) to JSON-compatible values,
+    with NaN as null.
+    """
+    if hasattr(result, "columns"):
+        return json.loads(result.to_json(orient="records"))
+    return json.loads(result.to_json(orient="index"))
+
+
+def serve(names):
+    """
+    Computes the requested aggregates for the filters in the query string,
+    unless the client already holds the current version.
+    """
+    registry = current_app.config["DATASET_REGISTRY"]
+    dataset = request.args.get("dataset") or registry.default
+    try:
+        loader = registry.get(dataset, timeout=0)
+    except KeyError:
+        return jsonify(error=f"Unknown dataset: {dataset}"), 404
+    if not loader.ready:
+        return jsonify(loader.status()), 503
+    filters = normalized_filters(request.args)
+    etag = make_etag(loader.data.version, dataset, names, filters)
+    cache_control = f'public, max-age={current_app.config["API_MAX_AGE"]}'
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+
+        def compute():
+            filtered = loader.data.filtered(*[filters.get(i) for i in filter_params])
+            return {i: to_json(getattr(filtered, aggregates[i])()) for i in names}
+
+        cache = current_app.config["RESULT_CACHE"]
+        if cache is None:
+            results = compute()
+        else:
+            key = cache.key("api", loader.data.version, names, filters)
+            results = cache.get_or_compute(key, compute)
+        response = jsonify(
+            dataset=dataset,
+            version=loader.data.version,
+            filters=filters,
+            aggregates=results,
+        )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+@api.route("/aggregates")
+def all_aggregates():
+    """
+    Every aggregate for the filter set (?dataset=&ship=&segment=&state=&month=&week=).
+    """
+    return serve(list(aggregates))
+
+
+@api.route("/aggregates/<name>")
+def one_aggregate(name):
+    """
+    A single aggregate, e.g. /api/v1/aggregates/ship_modes?segment=Consumer
+    """
+    if name not in aggregates:
+        return jsonify(error=f"Unknown aggregate: {name}"), 404
+    return serve([name])
+
+
+def register_api(server, registry, max_age=60, cache=None):
+    """
+    Mounts the API on the Flask server behind the Dash app.
+    :param server: Flask app (Dash app.server)
+    :param registry: DatasetRegistry serving the data
+    :param max_age: Seconds clients and caches may reuse a response (Cache-Control)
+    :param cache: Optional ResultCache shared with the other workers
+    """
+    server.config["DATASET_REGISTRY"] = registry
+    server.config["RESULT_CACHE"] = cache
+    server.config["API_MAX_AGE"] = max_age
+    server.register_blueprint(api)
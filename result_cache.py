@@ -0,0 +1,165 @@
+"""
+result_cache.py
+
+Result cache shared by every worker process on a host, so a selection
+computed by one worker is served from the cache by the others.
+
+Backed by diskcache (SQLite on local disk): process and thread safe, size
+bounded with least-recently-used eviction, no external service needed.
+https://grantjenks.com/docs/diskcache/
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import diskcache
+from plotly.io.json import to_json_plotly
+
+default_cache_dir = os.path.join(tempfile.gettempdir(), "superstore_dashboard_cache")
+
+# Bump when the layout of the cached values changes
+cache_format = 1
+
+# Modules whose code produces the cached results
+source_files = ["data.py", "components.py", "json_api.py", "dash_app.py"]
+
+
+def code_revision():
+    """
+    :return: Hash of the source of the modules producing cached results, so a
+             deploy never serves results computed by the previous code
+    """
+    digest = hashlib.sha1()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for name in source_files + [os.path.basename(__file__)]:
+        try:
+            with open(os.path.join(folder, name), "rb") as file:
+                digest.update(file.read())
+        except OSError:
+            digest.update(name.encode())
+    return digest.hexdigest()[:16]
+
+
+# Filter names, in data_copy order (also the /export and API query parameters)
+filter_params = ["ship", "segment", "state", "month", "week"]
+
+
+def normalize_filters(*filters):
+    """
+    The one normalization of a filter selection, shared by the card cache keys,
+    the JSON API and /export.
+    :param filters: Filter values (lists or None), in data_copy order
+    :return: dict of filter name -> sorted unique values (empty values and filters omitted)
+    """
+    normalized = {}
+    for name, values in zip(filter_params, filters):
+        values = sorted({v for v in values or [] if v})
+        if values:
+            normalized[name] = values
+    return normalized
+
+
+class ResultCache:
+    """
+    Stores computed results (Dash components, figures, aggregates) as JSON,
+    keyed on the cache format, the code revision, the dataset version and the
+    normalized filter values.
+    """
+
+    def __init__(
+        self, directory=default_cache_dir, size_limit=256 * 2**20, expire=24 * 3600
+    ):
+        """
+        :param directory: Folder of the cache, shared by the workers
+        :param size_limit: Maximum size of the cache on disk, in bytes
+        :param expire: Seconds a result is kept (None keeps it until evicted)
+        """
+        self.directory = directory
+        self.size_limit = size_limit
+        self.expire = expire
+        self.revision = code_revision()
+        self.hits = 0
+        self.misses = 0
+        self._cache = None
+        self._pid = None
+
+    @property
+    def cache(self):
+        """
+        The diskcache.Cache, opened once per process (SQLite connections must
+        not be shared across a fork).
+        """
+        if self._pid != os.getpid():
+            self._cache = diskcache.Cache(
+                self.directory,
+                size_limit=self.size_limit,
+                eviction_policy="least-recently-used",
+            )
+            self._pid = os.getpid()
+        return self._cache
+
+    def key(self, kind, version, *parts):
+        """
+        :param kind: What is cached (e.g. "cards")
+        :param version: Version of the dataset the result was computed from
+        :param parts: Anything else the result depends on (normalized filters...)
+        :return: Cache key
+        """
+        key = json.dumps(
+            [cache_format, self.revision, kind, version, *parts], sort_keys=True
+        )
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Cached results come back as plain JSON values (components as dicts,
+        which Dash renders like the original components).
+        :param key: Key from ResultCache.key()
+        :return: The cached result for key, or None
+        """
+        try:
+            cached = self.cache.get(key)
+        except Exception as e:
+            print(f"Error reading result cache: {e}")
+            return None
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(cached)
+
+    def set(self, key, result):
+        """
+        Stores a result, serialized to JSON.
+        :param key: Key from ResultCache.key()
+        :param result: Result to store
+        """
+        try:
+            self.cache.set(key, to_json_plotly(result), expire=self.expire)
+        except Exception as e:
+            print(f"Error writing result cache: {e}")
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached result for key, or computes and stores it.
+        :param key: Key from ResultCache.key()
+        :param compute: Callable producing the result on a miss
+        """
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.set(key, result)
+        return result
+
+    def stats(self):
+        """
+        :return: dict with this process's hits and misses and the cache size
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size_bytes": self.cache.volume(),
+            "size_limit": self.size_limit,
+        }